@@ -1,15 +1,47 @@
 import os
-from fastapi import FastAPI, Request
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from redis.asyncio import Redis
+from fastapi import FastAPI
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
-from fastapi.responses import HTMLResponse
+from fastapi.responses import HTMLResponse, ORJSONResponse
 from .routes import api
+from .room_analyzer import create_openai_client
+from .rate_limiter import StatusTracker
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Create shared clients on startup and release them on shutdown"""
+    # asyncio.to_thread work (image resizing, encoding, hashing, report writes) shares one sized pool
+    executor = ThreadPoolExecutor(
+        max_workers=int(os.getenv('THREAD_POOL_MAX_WORKERS', '32')),
+        thread_name_prefix='room-analyzer'
+    )
+    asyncio.get_running_loop().set_default_executor(executor)
+    app.state.openai_client = create_openai_client()
+    # Job status lives in Redis so any uvicorn worker can serve /status and /result
+    app.state.redis_client = Redis.from_url(
+        os.getenv('REDIS_URL', 'redis://localhost:6379/0'),
+        max_connections=50
+    )
+    # The OpenAI limits are account-wide, so the workers share one set of buckets in Redis
+    app.state.status_tracker = StatusTracker.from_env(redis=app.state.redis_client)
+    # The page has no per-request context, so render it once
+    app.state.index_html = templates.get_template("index.html").render()
+    yield
+    await app.state.openai_client.close()
+    await app.state.redis_client.aclose()
+    executor.shutdown(wait=True)
 
 # Create FastAPI app
 app = FastAPI(
     title="Room Analyzer Web Interface",
     description="Web interface for analyzing room images using AI",
-    version="1.0.0"
+    version="1.0.0",
+    default_response_class=ORJSONResponse,
+    lifespan=lifespan
 )
 
 # Mount static files
@@ -26,9 +58,9 @@ os.makedirs("uploads", exist_ok=True)
 os.makedirs("outputs", exist_ok=True)
 
 @app.get("/", response_class=HTMLResponse)
-async def home(request: Request):
+async def home():
     """Serve the main page"""
-    return templates.TemplateResponse("index.html", {"request": request})
+    return HTMLResponse(app.state.index_html)
 
 @app.get("/health")
 async def health_check():
@@ -2,16 +2,17 @@ from typing import List, Dict, Optional, Any
 from pydantic import BaseModel, Field
 
 class RoomFeatures(BaseModel):
+    # Sections the prompt treats as "if applicable" default to empty rather than rejecting the room
     wiring: Dict[str, Any] = Field(..., description="Electrical system status")
-    hvac: Dict[str, Any] = Field(..., description="HVAC systems")
+    hvac: Dict[str, Any] = Field(default_factory=dict, description="HVAC systems")
     flooring: Dict[str, Any] = Field(..., description="Flooring material and condition")
     walls: Dict[str, Any] = Field(..., description="Wall condition and paint")
     ceiling: Dict[str, Any] = Field(..., description="Ceiling material and condition")
     doors_and_windows: Dict[str, Any] = Field(..., description="Doors and windows")
-    fixtures: Dict[str, Any] = Field(..., description="All fixtures")
+    fixtures: Dict[str, Any] = Field(default_factory=dict, description="All fixtures")
     furnishings: List[Dict[str, Any]] = Field(..., description="Furniture items")
-    kitchen_appliances: Dict[str, Any] = Field(..., description="Kitchen appliances")
-    balcony: Dict[str, Any] = Field(..., description="Balcony details")
+    kitchen_appliances: Dict[str, Any] = Field(default_factory=dict, description="Kitchen appliances")
+    balcony: Dict[str, Any] = Field(default_factory=dict, description="Balcony details")
 
 class ObjectCounts(BaseModel):
     sofa: int = Field(0, description="Number of sofas")
@@ -35,6 +36,9 @@ class RoomExtractionSchema(BaseModel):
     features: RoomFeatures = Field(..., description="Detailed room features")
     object_counts: ObjectCounts = Field(..., description="Count of all objects")
 
+class RoomBatchSchema(BaseModel):
+    rooms: List[RoomExtractionSchema] = Field(..., description="One entry per analyzed room image")
+
 class AIAgentInstructions(BaseModel):
     information: str = Field("Analyze room images for detailed assessment", description="Context information")
     instruction: str = Field("Extract comprehensive room details", description="Main instruction")
@@ -0,0 +1,128 @@
+import os
+import time
+import asyncio
+from dataclasses import dataclass, field
+from typing import Optional
+from redis.asyncio import Redis
+from redis.exceptions import RedisError
+
+# Refill, then consume or report the wait, atomically against Redis server time
+# so every uvicorn worker draws from the same account-wide buckets
+BUCKET_SCRIPT = """
+local now = redis.call('TIME')
+now = tonumber(now[1]) + tonumber(now[2]) / 1000000
+local max_requests = tonumber(ARGV[1])
+local max_tokens = tonumber(ARGV[2])
+local cost = tonumber(ARGV[3])
+local state = redis.call('HMGET', KEYS[1], 'requests', 'tokens', 'updated')
+local requests = tonumber(state[1]) or max_requests
+local tokens = tonumber(state[2]) or max_tokens
+local elapsed = math.max(now - (tonumber(state[3]) or now), 0)
+requests = math.min(requests + max_requests * elapsed / 60, max_requests)
+tokens = math.min(tokens + max_tokens * elapsed / 60, max_tokens)
+local wait = 0
+if ARGV[4] == '1' then
+    requests = 0
+    tokens = 0
+elseif requests >= 1 and tokens >= cost then
+    requests = requests - 1
+    tokens = tokens - cost
+else
+    wait = math.max((1 - requests) * 60 / max_requests, (cost - tokens) * 60 / max_tokens, 0.001)
+end
+redis.call('HSET', KEYS[1], 'requests', tostring(requests), 'tokens', tostring(tokens), 'updated', tostring(now))
+redis.call('EXPIRE', KEYS[1], 120)
+return tostring(wait)
+"""
+
+@dataclass
+class StatusTracker:
+    """Leaky-bucket tracker for OpenAI request and token capacity per minute"""
+    max_requests_per_minute: float
+    max_tokens_per_minute: float
+    available_request_capacity: float = field(init=False)
+    available_token_capacity: float = field(init=False)
+    last_update_time: float = field(init=False)
+    num_rate_limit_errors: int = 0
+    # With Redis the buckets are shared by every worker; without it they are per process
+    redis: Optional[Redis] = field(default=None, repr=False)
+    redis_key: str = 'ratelimit:openai'
+
+    def __post_init__(self):
+        self.available_request_capacity = self.max_requests_per_minute
+        self.available_token_capacity = self.max_tokens_per_minute
+        self.last_update_time = time.monotonic()
+        self.bucket_script = self.redis.register_script(BUCKET_SCRIPT) if self.redis is not None else None
+
+    @classmethod
+    def from_env(cls, redis: Optional[Redis] = None) -> "StatusTracker":
+        """Build a tracker from the MAX_REQUESTS_PER_MINUTE / MAX_TOKENS_PER_MINUTE settings"""
+        return cls(
+            max_requests_per_minute=float(os.getenv('MAX_REQUESTS_PER_MINUTE', '500')),
+            max_tokens_per_minute=float(os.getenv('MAX_TOKENS_PER_MINUTE', '30000')),
+            redis=redis
+        )
+
+    def refill(self):
+        """Top both buckets up by the capacity earned since the last update"""
+        now = time.monotonic()
+        elapsed = now - self.last_update_time
+        self.available_request_capacity = min(
+            self.available_request_capacity + self.max_requests_per_minute * elapsed / 60,
+            self.max_requests_per_minute
+        )
+        self.available_token_capacity = min(
+            self.available_token_capacity + self.max_tokens_per_minute * elapsed / 60,
+            self.max_tokens_per_minute
+        )
+        self.last_update_time = now
+
+    def take_local(self, token_cost: float) -> float:
+        """Consume from the in-process buckets, or return how long to wait before retrying"""
+        self.refill()
+        request_shortfall = 1 - self.available_request_capacity
+        token_shortfall = token_cost - self.available_token_capacity
+        if request_shortfall <= 0 and token_shortfall <= 0:
+            self.available_request_capacity -= 1
+            self.available_token_capacity -= token_cost
+            return 0
+        # Sleep just long enough for the scarcer bucket to refill
+        return max(
+            request_shortfall * 60 / self.max_requests_per_minute,
+            token_shortfall * 60 / self.max_tokens_per_minute,
+            0.001
+        )
+
+    async def take_shared(self, token_cost: float, drain: bool = False) -> Optional[float]:
+        """Consume from (or drain) the Redis buckets; None if Redis is unavailable"""
+        if self.bucket_script is None:
+            return None
+        try:
+            wait = await self.bucket_script(
+                keys=[self.redis_key],
+                args=[self.max_requests_per_minute, self.max_tokens_per_minute, token_cost, int(drain)]
+            )
+            return float(wait)
+        except RedisError as e:
+            print(f"Error using shared rate limit, falling back to local: {str(e)}")
+            return None
+
+    async def acquire(self, token_cost: int):
+        """Wait until both buckets can cover one request of the given token cost, then consume it"""
+        # A request larger than the whole bucket would otherwise wait forever
+        token_cost = min(token_cost, self.max_tokens_per_minute)
+        while True:
+            wait = await self.take_shared(token_cost)
+            if wait is None:
+                wait = self.take_local(token_cost)
+            if wait <= 0:
+                return
+            await asyncio.sleep(wait)
+
+    async def record_rate_limit_error(self):
+        """Drain both buckets so every pending request backs off after a 429"""
+        self.num_rate_limit_errors += 1
+        self.available_request_capacity = 0
+        self.available_token_capacity = 0
+        self.last_update_time = time.monotonic()
+        await self.take_shared(0, drain=True)
@@ -1,39 +1,57 @@
 import os
-import json
+import orjson
+import io
 import base64
-from openai import OpenAI
+import hashlib
+import httpx
+import aiofiles
+from openai import AsyncOpenAI, RateLimitError, APIConnectionError, InternalServerError
+from tenacity import retry, wait_random_exponential, stop_after_attempt, retry_if_exception_type
 from dotenv import load_dotenv
-from PIL import Image
+from PIL import Image, ImageOps
 import uuid
 import asyncio
+from operator import itemgetter
 from typing import List, Dict, Optional
-from .models import AIAgentInstructions
+from redis.asyncio import Redis
+from .models import AIAgentInstructions, RoomBatchSchema, RoomExtractionSchema
+from .rate_limiter import StatusTracker
 
 load_dotenv()
 
-class RoomAnalyzer:
-    def __init__(self):
-        self.client = OpenAI(api_key=os.getenv('OPENAI_API_KEY'))
-        self.ai_instructions = AIAgentInstructions()
-        # Configuration for parallel processing
-        self.max_concurrent_requests = int(os.getenv('MAX_CONCURRENT_REQUESTS', '5'))
-        self.request_delay = float(os.getenv('REQUEST_DELAY', '0.2'))  # 200ms between requests
-        
-    def encode_image(self, image_path: str) -> str:
-        """Encode image to base64 for API"""
-        with open(image_path, "rb") as image_file:
-            return base64.b64encode(image_file.read()).decode('utf-8')
+# Rough token cost of one high-detail photo once OpenAI has scaled it into 512px tiles
+IMAGE_TOKEN_ESTIMATE = 765
+LOW_DETAIL_IMAGE_TOKENS = 85
+# OpenAI scales high-detail images to fit 2048px and then 768px on the short side,
+# so anything larger only costs upload time
+MAX_IMAGE_DIMENSION = 1536
+JPEG_QUALITY = 85
+MAX_TOKENS_PER_ROOM = 1500
+REQUEST_TIMEOUT_SECONDS = 60
+REQUEST_TIMEOUT_PER_ROOM_SECONDS = 60
+MAX_ATTEMPTS = 3
+ROOM_CACHE_TTL_SECONDS = 30 * 86400  # 30 days
+PREPARE_CONCURRENCY = 8  # images read, hashed and encoded at once
 
-    async def analyze_room_async(self, image_path: str) -> Optional[str]:
-        """Analyze a single room image using GPT-4 Vision"""
-        base64_image = self.encode_image(image_path)
-        
-        prompt = f"""
-        {self.ai_instructions.information}
-        {self.ai_instructions.instruction}
-        {self.ai_instructions.condition}
+get_summary_features = itemgetter('balcony', 'doors_and_windows', 'furnishings')
+
+# Constrain the vision call to the room schema so no second text-to-JSON pass is needed
+ROOM_RESPONSE_FORMAT = {
+    "type": "json_schema",
+    "json_schema": {
+        "name": "room_batch",
+        "schema": RoomBatchSchema.model_json_schema()
+    }
+}
+
+# Built once at import; literal braces in the JSON layout are doubled for str.format
+ROOM_PROMPT_TEMPLATE = """
+        {information}
+        {instruction}
+        {condition}
 
-        Analyze this room image and provide a comprehensive assessment focusing on:
+        You are given {room_count} room images, each preceded by its room id ({room_ids}).
+        Analyze every room image and provide a comprehensive assessment of each focusing on:
         
         1. Room type identification (bedroom, living_room, kitchen, bathroom, etc.)
         2. Luxury tier assessment (high, medium, low based on visible quality, materials, and furnishings)
@@ -55,48 +73,12 @@ class RoomAnalyzer:
         - Kitchen appliances (if applicable)
         - Balcony details (if visible)
         
-        Be specific with counts and conditions. State assumptions clearly.
-        """
+        Be specific with counts and conditions. Make reasonable estimates for anything not visible.
         
-        try:
-            response = await asyncio.get_event_loop().run_in_executor(
-                None,
-                lambda: self.client.chat.completions.create(
-                    model="gpt-4o",
-                    messages=[
-                        {
-                            "role": "user",
-                            "content": [
-                                {"type": "text", "text": prompt},
-                                {
-                                    "type": "image_url",
-                                    "image_url": {"url": f"data:image/jpeg;base64,{base64_image}"}
-                                }
-                            ]
-                        }
-                    ],
-                    max_tokens=4000
-                )
-            )
-            
-            return response.choices[0].message.content
-            
-        except Exception as e:
-            print(f"Error analyzing image {image_path}: {str(e)}")
-            return None
-
-    async def convert_to_structured_json_async(self, analysis_text: str, room_id: str) -> Optional[Dict]:
-        """Convert analysis text to structured JSON format"""
-        
-        schema_prompt = f"""
-        Convert the following room analysis into the exact JSON format specified below.
-        Make reasonable estimates for any missing information based on the analysis.
-        
-        Analysis: {analysis_text}
-        
-        Return ONLY valid JSON matching this structure:
+        Return ONLY valid JSON of the form {{"rooms": [...]}} with one object per image, in the
+        order given, where each room object matches this structure:
         {{
-            "room_id": "{room_id}",
+            "room_id": "the room id shown before the image",
             "room_type": "bedroom | living_room | kitchen | bathroom | balcony | dining | study | utility | other",
             "estimated_area_sqm": number,
             "features": {{
@@ -204,69 +186,252 @@ class RoomAnalyzer:
             }}
         }}
         """
+
+# Changes to the prompt, schema or image preprocessing invalidate previously cached room analyses
+PROMPT_VERSION = hashlib.sha256(
+    ROOM_PROMPT_TEMPLATE.encode()
+    + orjson.dumps(ROOM_RESPONSE_FORMAT)
+    + orjson.dumps({"max_image_dimension": MAX_IMAGE_DIMENSION, "jpeg_quality": JPEG_QUALITY})
+).hexdigest()[:12]
+
+def create_openai_client() -> AsyncOpenAI:
+    """Create an AsyncOpenAI client backed by a pooled HTTP/2 connection"""
+    return AsyncOpenAI(
+        api_key=os.getenv('OPENAI_API_KEY'),
+        # Retries are handled by RoomAnalyzer so they go back through the rate limiter
+        max_retries=0,
+        http_client=httpx.AsyncClient(
+            limits=httpx.Limits(max_connections=100, max_keepalive_connections=50),
+            http2=True,
+            timeout=REQUEST_TIMEOUT_SECONDS
+        )
+    )
+
+class RoomAnalyzer:
+    def __init__(
+        self,
+        client: Optional[AsyncOpenAI] = None,
+        status_tracker: Optional[StatusTracker] = None,
+        cache: Optional[Redis] = None
+    ):
+        # Reuse the app-wide client when given so the connection pool survives across uploads
+        self.client = client or create_openai_client()
+        self.ai_instructions = AIAgentInstructions()
+        # Rate limits are per account, so share the app-wide tracker when given
+        self.status_tracker = status_tracker or StatusTracker.from_env()
+        # Several rooms share one request to amortize the prompt and save on requests per minute
+        self.rooms_per_request = int(os.getenv('ROOMS_PER_REQUEST', '4'))
+        # Batches in flight at once; bounds how many encoded images wait on the rate limiter
+        self.max_concurrent_requests = int(os.getenv('MAX_CONCURRENT_REQUESTS', '5'))
+        # 'low' trades detail for a fixed, much smaller token cost per image
+        self.image_detail = os.getenv('IMAGE_DETAIL', 'high')
+        # Optional Redis cache of room analyses keyed by image content
+        self.cache = cache
+        
+    async def read_image(self, image_path: str) -> bytes:
+        """Read image bytes without blocking the event loop"""
+        async with aiofiles.open(image_path, "rb") as image_file:
+            return await image_file.read()
+
+    def downscale_image(self, image_data: bytes) -> bytes:
+        """Shrink an image to MAX_IMAGE_DIMENSION on its long side and re-encode it as JPEG"""
+        with Image.open(io.BytesIO(image_data)) as image:
+            if image.format == 'JPEG' and max(image.size) <= MAX_IMAGE_DIMENSION:
+                return image_data
+            # Bake in the EXIF rotation since re-encoding drops the tag
+            image = ImageOps.exif_transpose(image).convert('RGB')
+            image.thumbnail((MAX_IMAGE_DIMENSION, MAX_IMAGE_DIMENSION), Image.LANCZOS)
+            buffer = io.BytesIO()
+            image.save(buffer, 'JPEG', quality=JPEG_QUALITY)
+            return buffer.getvalue()
+
+    async def encode_image(self, image_data: bytes) -> str:
+        """Downscale and base64-encode an image for the API without blocking the event loop"""
+        jpeg_data = await asyncio.to_thread(self.downscale_image, image_data)
+        encoded = await asyncio.to_thread(base64.b64encode, jpeg_data)
+        return encoded.decode('ascii')
+
+    async def room_cache_key(self, image_data: bytes) -> str:
+        """Content-addressed cache key for an image under the current prompt version and detail level"""
+        digest = await asyncio.to_thread(hashlib.sha256, image_data)
+        return f"room:{digest.hexdigest()}:{PROMPT_VERSION}:{self.image_detail}"
+
+    async def load_cached_rooms(self, cache_keys: List[str]) -> List[Optional[Dict]]:
+        """Look up previously analyzed rooms, treating cache errors as misses"""
+        # MGET with no keys is a Redis error, e.g. when every image in a group failed to read
+        if not cache_keys:
+            return []
+        if self.cache is None:
+            return [None] * len(cache_keys)
+        try:
+            cached = await self.cache.mget(cache_keys)
+            return [orjson.loads(room) if room is not None else None for room in cached]
+        except Exception as e:
+            print(f"Error reading room cache: {str(e)}")
+            return [None] * len(cache_keys)
+
+    async def store_cached_rooms(self, rooms_by_key: Dict[str, Dict]):
+        """Cache freshly analyzed rooms, ignoring cache errors"""
+        if self.cache is None or not rooms_by_key:
+            return
+        try:
+            async with self.cache.pipeline(transaction=False) as pipe:
+                for cache_key, room in rooms_by_key.items():
+                    pipe.set(cache_key, orjson.dumps(room), ex=ROOM_CACHE_TTL_SECONDS)
+                await pipe.execute()
+        except Exception as e:
+            print(f"Error writing room cache: {str(e)}")
+
+    @retry(
+        wait=wait_random_exponential(min=1, max=30),
+        stop=stop_after_attempt(MAX_ATTEMPTS),
+        retry=retry_if_exception_type((RateLimitError, APIConnectionError, InternalServerError)),
+        reraise=True
+    )
+    async def _call_openai(self, token_cost: int, **kwargs):
+        """Create a chat completion once rate limits allow, retrying transient failures with jittered backoff"""
+        await self.status_tracker.acquire(token_cost)
+        try:
+            return await self.client.chat.completions.create(**kwargs)
+        except RateLimitError:
+            await self.status_tracker.record_rate_limit_error()
+            raise
+
+    async def analyze_rooms_batch_async(self, base64_images: List[str], room_ids: List[str]) -> List[Optional[Dict]]:
+        """Analyze several encoded room images with one GPT-4 Vision call, returning rooms in input order"""
+        content = []
+        for base64_image, room_id in zip(base64_images, room_ids):
+            content.append({"type": "text", "text": f"Image for {room_id}:"})
+            content.append({
+                "type": "image_url",
+                "image_url": {"url": f"data:image/jpeg;base64,{base64_image}", "detail": self.image_detail}
+            })
+        
+        prompt = ROOM_PROMPT_TEMPLATE.format(
+            information=self.ai_instructions.information,
+            instruction=self.ai_instructions.instruction,
+            condition=self.ai_instructions.condition,
+            room_count=len(room_ids),
+            room_ids=", ".join(room_ids)
+        )
+        
+        max_tokens = MAX_TOKENS_PER_ROOM * len(room_ids)
+        image_tokens = LOW_DETAIL_IMAGE_TOKENS if self.image_detail == 'low' else IMAGE_TOKEN_ESTIMATE
+        token_cost = len(prompt) // 4 + image_tokens * len(room_ids) + max_tokens
+        content.insert(0, {"type": "text", "text": prompt})
         
         try:
-            response = await asyncio.get_event_loop().run_in_executor(
-                None,
-                lambda: self.client.chat.completions.create(
-                    model="gpt-4o-mini",
-                    messages=[{"role": "user", "content": schema_prompt}],
-                    max_tokens=1200
-                )
+            response = await self._call_openai(
+                token_cost,
+                model="gpt-4o",
+                messages=[{"role": "user", "content": content}],
+                response_format=ROOM_RESPONSE_FORMAT,
+                max_tokens=max_tokens,
+                # A non-streamed reply arrives only once fully generated, so allow time per room
+                timeout=REQUEST_TIMEOUT_SECONDS + REQUEST_TIMEOUT_PER_ROOM_SECONDS * len(room_ids)
             )
             
-            json_text = response.choices[0].message.content.strip()
-            
-            if json_text.startswith('```json'):
-                json_text = json_text[7:]
-            if json_text.endswith('```'):
-                json_text = json_text[:-3]
-            
-            return json.loads(json_text)
+            batch = orjson.loads(response.choices[0].message.content)
             
         except Exception as e:
-            print(f"Error converting analysis to JSON: {str(e)}")
-            return None
-
-    async def process_single_image_async(self, image_path: str, room_id: str, room_number: int) -> Optional[Dict]:
-        """Process a single image asynchronously"""
-        print(f"🔍 Analyzing room {room_number}: {image_path}")
-        
-        analysis = await self.analyze_room_async(image_path)
-        if analysis:
-            room_data = await self.convert_to_structured_json_async(analysis, room_id)
-            if room_data:
-                print(f"✓ Room {room_number} analyzed successfully")
-                return room_data
-            else:
-                print(f"✗ Failed to process room {room_number}")
-        else:
-            print(f"✗ Failed to analyze room {room_number}")
+            print(f"Error analyzing {', '.join(room_ids)}: {str(e)}")
+            return [None] * len(room_ids)
         
-        return None
+        # Validate rooms one by one so a malformed room fails only itself
+        rooms_by_id = {}
+        for room_data in (batch.get("rooms") if isinstance(batch, dict) else None) or []:
+            try:
+                room = RoomExtractionSchema.model_validate(room_data)
+            except Exception as e:
+                print(f"Error validating room {room_data.get('room_id') if isinstance(room_data, dict) else room_data}: {str(e)}")
+                continue
+            rooms_by_id[room.room_id] = room.model_dump()
+        return [rooms_by_id.get(room_id) for room_id in room_ids]
 
     async def process_multiple_images_async(self, image_paths: List[str]) -> List[Dict]:
-        """Process multiple images in parallel for faster processing while respecting rate limits."""
+        """Process multiple images through a prepare -> analyze pipeline while respecting rate limits."""
         if not image_paths:
             return []
 
-        print(f"\n📸 Processing {len(image_paths)} images in parallel (max {self.max_concurrent_requests} concurrent)...")
+        room_ids = [f"room_{i:03d}" for i in range(1, len(image_paths) + 1)]
+        batch_size = self.rooms_per_request
+        print(f"\n📸 Processing {len(image_paths)} images in batches of {batch_size} (max {self.status_tracker.max_requests_per_minute:.0f} requests/min)...")
 
-        # Create a semaphore to limit concurrent API requests
-        semaphore = asyncio.Semaphore(self.max_concurrent_requests)
-        
-        # Create tasks for all images to be processed concurrently
-        tasks = []
-        for i, image_path in enumerate(image_paths, 1):
-            room_id = f"room_{i:03d}"
-            # Add a small staggered delay to avoid overwhelming the API
-            delay = (i - 1) * self.request_delay
-            task = self.process_single_image_with_semaphore(image_path, room_id, i, delay, semaphore)
-            tasks.append(task)
+        results: List = [None] * len(image_paths)
+        workers = self.max_concurrent_requests
+        # Full batches flow from the prepare stage to a fixed pool of analyze workers. The queue
+        # is bounded so images are only read and encoded shortly before a worker can send them;
+        # None tells a worker to stop
+        prepared = asyncio.Queue(maxsize=workers)
+        prepare_semaphore = asyncio.Semaphore(PREPARE_CONCURRENCY)
+
+        async def read_and_hash(index: int):
+            """Read one image and compute its cache key, recording a failure for its room"""
+            try:
+                async with prepare_semaphore:
+                    image_data = await self.read_image(image_paths[index])
+                    return index, image_data, await self.room_cache_key(image_data)
+            except Exception as e:
+                results[index] = e
+                return None
+
+        async def encode(index: int, image_data: bytes) -> Optional[str]:
+            """Downscale and encode one image; decoding here means a bad image fails only its own room"""
+            try:
+                async with prepare_semaphore:
+                    return await self.encode_image(image_data)
+            except Exception as e:
+                results[index] = e
+                return None
+
+        async def produce():
+            batch = []
+            try:
+                for start in range(0, len(image_paths), PREPARE_CONCURRENCY):
+                    hashed = [item for item in await asyncio.gather(
+                        *(read_and_hash(index) for index in range(start, min(start + PREPARE_CONCURRENCY, len(image_paths))))
+                    ) if item]
+                    # One cache round trip for the whole group
+                    cached_rooms = await self.load_cached_rooms([cache_key for _, _, cache_key in hashed])
+                    misses = []
+                    for (index, image_data, cache_key), cached_room in zip(hashed, cached_rooms):
+                        if cached_room:
+                            # Cached rooms may come from another upload, so stamp them with this upload's room id
+                            results[index] = dict(cached_room, room_id=room_ids[index])
+                        else:
+                            misses.append((index, image_data, cache_key))
+                    encoded = await asyncio.gather(*(encode(index, image_data) for index, image_data, _ in misses))
+                    for (index, _, cache_key), base64_image in zip(misses, encoded):
+                        if base64_image is None:
+                            continue
+                        batch.append((index, base64_image, cache_key))
+                        if len(batch) == batch_size:
+                            await prepared.put(batch)
+                            batch = []
+                if batch:
+                    await prepared.put(batch)
+            finally:
+                for _ in range(workers):
+                    await prepared.put(None)
+
+        async def analyze(batch: List):
+            """Send one batch of prepared images to GPT-4o and cache what comes back"""
+            indices, base64_images, cache_keys = zip(*batch)
+            rooms = await self.analyze_rooms_batch_async(list(base64_images), [room_ids[i] for i in indices])
+            await self.store_cached_rooms({key: room for key, room in zip(cache_keys, rooms) if room})
+            for index, room in zip(indices, rooms):
+                results[index] = room
+
+        async def consume():
+            # The status tracker still decides when each worker's request actually goes out
+            while (batch := await prepared.get()) is not None:
+                try:
+                    await analyze(batch)
+                except Exception as e:
+                    print(f"❌ Error analyzing batch: {str(e)}")
 
-        # Process all images concurrently
         try:
-            results = await asyncio.gather(*tasks, return_exceptions=True)
+            await asyncio.gather(produce(), *(consume() for _ in range(workers)))
             
             # Filter out failed results and exceptions
             rooms = []
@@ -286,30 +451,27 @@ class RoomAnalyzer:
             print(f"❌ Error during parallel processing: {str(e)}")
             return []
 
-    async def process_single_image_with_semaphore(self, image_path: str, room_id: str, room_number: int, delay: float, semaphore: asyncio.Semaphore) -> Optional[Dict]:
-        """Process a single image with semaphore control and delay for rate limiting"""
-        if delay > 0:
-            await asyncio.sleep(delay)
-        
-        async with semaphore:
-            return await self.process_single_image_async(image_path, room_id, room_number)
-
     def generate_house_summary(self, rooms: List[Dict]) -> Dict:
         """Generate summary statistics for the entire house"""
         if not rooms:
             return {}
         
         total_rooms = len(rooms)
-        rooms_with_balcony = sum(1 for room in rooms if room['features']['balcony']['present'])
-        total_windows = sum(room['features']['doors_and_windows']['window_count'] for room in rooms)
-        total_doors = sum(room['features']['doors_and_windows']['door_count'] for room in rooms)
-        total_furnishings = sum(len(room['features']['furnishings']) for room in rooms)
-        
+        rooms_with_balcony = 0
+        total_windows = 0
+        total_doors = 0
+        total_furnishings = 0
         unique_objects = set()
+        
+        # Single pass over the rooms, accumulating every statistic at once
         for room in rooms:
-            for obj_type, count in room['object_counts'].items():
-                if count > 0:
-                    unique_objects.add(obj_type)
+            balcony, doors_and_windows, furnishings = get_summary_features(room['features'])
+            if balcony.get('present'):
+                rooms_with_balcony += 1
+            total_windows += doors_and_windows.get('window_count', 0)
+            total_doors += doors_and_windows.get('door_count', 0)
+            total_furnishings += len(furnishings)
+            unique_objects.update(obj_type for obj_type, count in room['object_counts'].items() if count > 0)
         
         return {
             "total_rooms": total_rooms,
@@ -345,8 +507,9 @@ class RoomAnalyzer:
             os.makedirs(output_dir, exist_ok=True)
             output_file = os.path.join(output_dir, f"house_analysis_{house_id[:8]}.json")
             
-            with open(output_file, 'w') as f:
-                json.dump(final_report, f, indent=2)
+            report_bytes = await asyncio.to_thread(orjson.dumps, final_report, option=orjson.OPT_INDENT_2)
+            async with aiofiles.open(output_file, 'wb') as f:
+                await f.write(report_bytes)
             
             return {
                 "status": "success",
@@ -1,59 +1,119 @@
 import os
 import time
 import uuid
-from typing import List
-from fastapi import APIRouter, File, UploadFile, HTTPException, BackgroundTasks
-from fastapi.responses import JSONResponse, FileResponse
+import asyncio
+import orjson
+import aiofiles
+from typing import List, Dict, Any, Iterable, AsyncIterator
+from redis.asyncio import Redis
+from starlette.datastructures import State
+from fastapi import APIRouter, File, UploadFile, HTTPException, BackgroundTasks, Request, Depends, Response
+from fastapi.responses import ORJSONResponse, StreamingResponse, FileResponse
 from ..room_analyzer import RoomAnalyzer
 from ..models import UploadResponse, AnalysisResult
 import shutil
 
 router = APIRouter()
 
-# In-memory storage for processing status
-processing_status = {}
+UPLOAD_CHUNK_SIZE = 1 << 20  # 1MB
+STATUS_TTL_SECONDS = 86400  # 24 hours
+
+def get_redis(request: Request) -> Redis:
+    """Dependency returning the app-wide Redis client"""
+    return request.app.state.redis_client
+
+async def set_processing_status(redis_client: Redis, house_id: str, status: Dict[str, Any]):
+    """Store processing status in Redis so every worker sees it"""
+    await redis_client.set(f"job:{house_id}", orjson.dumps(status), ex=STATUS_TTL_SECONDS)
+
+async def load_processing_status(redis_client: Redis, house_id: str) -> bytes:
+    """Fetch the raw JSON processing status for a house, or raise 404"""
+    status = await redis_client.get(f"job:{house_id}")
+    if status is None:
+        raise HTTPException(status_code=404, detail="House ID not found")
+    return status
 
 def allowed_file(filename: str) -> bool:
     """Check if file extension is allowed"""
     allowed_extensions = os.getenv('ALLOWED_EXTENSIONS', 'jpg,jpeg,png,bmp,tiff').split(',')
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in allowed_extensions
 
-def save_uploaded_files(files: List[UploadFile], house_id: str) -> List[str]:
-    """Save uploaded files and return their paths"""
+async def stream_json_array(items: Iterable[Any]) -> AsyncIterator[bytes]:
+    """Yield a JSON array one encoded element at a time"""
+    yield b"["
+    for index, item in enumerate(items):
+        if index:
+            yield b","
+        yield orjson.dumps(item)
+    yield b"]"
+
+async def stream_json_object(obj: Dict[str, Any], stream_key: str, value_stream: AsyncIterator[bytes]) -> AsyncIterator[bytes]:
+    """Yield a JSON object in key order, taking the value of stream_key from an encoded byte stream"""
+    yield b"{"
+    for index, (key, value) in enumerate(obj.items()):
+        if index:
+            yield b","
+        yield orjson.dumps(key) + b":"
+        if key == stream_key:
+            async for chunk in value_stream:
+                yield chunk
+        else:
+            yield orjson.dumps(value)
+    yield b"}"
+
+def stream_report(report: Dict[str, Any]) -> AsyncIterator[bytes]:
+    """Stream a house report with its rooms encoded room by room"""
+    return stream_json_object(report, "rooms", stream_json_array(report["rooms"]))
+
+async def save_uploaded_files(files: List[UploadFile], house_id: str, max_size: int) -> List[str]:
+    """Stream uploaded files to disk, rejecting any larger than max_size, and return their paths"""
     upload_dir = os.getenv('UPLOAD_DIR', 'uploads')
     house_dir = os.path.join(upload_dir, house_id)
     os.makedirs(house_dir, exist_ok=True)
     
     saved_paths = []
-    for index, file in enumerate(files):
-        if file.filename and allowed_file(file.filename):
-            base_name, ext = os.path.splitext(file.filename)
-            # Ensure unique filenames to prevent overwriting
-            unique_name = f"{base_name}_{index:03d}{ext.lower()}"
-            file_path = os.path.join(house_dir, unique_name)
-            # If somehow exists, add a uuid suffix
-            counter = 1
-            while os.path.exists(file_path):
-                unique_name = f"{base_name}_{index:03d}_{counter}{ext.lower()}"
+    try:
+        for index, file in enumerate(files):
+            if file.filename and allowed_file(file.filename):
+                base_name, ext = os.path.splitext(file.filename)
+                # Ensure unique filenames to prevent overwriting
+                unique_name = f"{base_name}_{index:03d}{ext.lower()}"
                 file_path = os.path.join(house_dir, unique_name)
-                counter += 1
-            # Ensure file stream is at the start before copying
-            try:
-                file.file.seek(0)
-            except Exception:
-                pass
-            with open(file_path, "wb") as buffer:
-                shutil.copyfileobj(file.file, buffer)
-            saved_paths.append(file_path)
+                # If somehow exists, add a uuid suffix
+                counter = 1
+                while os.path.exists(file_path):
+                    unique_name = f"{base_name}_{index:03d}_{counter}{ext.lower()}"
+                    file_path = os.path.join(house_dir, unique_name)
+                    counter += 1
+                # Copy in chunks, checking the size as we go so the file is never held in memory
+                total_size = 0
+                async with aiofiles.open(file_path, "wb") as buffer:
+                    while chunk := await file.read(UPLOAD_CHUNK_SIZE):
+                        total_size += len(chunk)
+                        if total_size > max_size:
+                            raise HTTPException(
+                                status_code=400,
+                                detail=f"File too large: {file.filename}"
+                            )
+                        await buffer.write(chunk)
+                saved_paths.append(file_path)
+    except HTTPException:
+        await asyncio.to_thread(shutil.rmtree, house_dir, ignore_errors=True)
+        raise
     
     return saved_paths
 
-async def process_images_background(house_id: str, image_paths: List[str]):
+async def process_images_background(house_id: str, image_paths: List[str], state: State):
     """Background task to process images"""
+    redis_client = state.redis_client
     try:
-        processing_status[house_id] = {"status": "processing", "progress": 0}
+        await set_processing_status(redis_client, house_id, {"status": "processing", "progress": 0})
         
-        analyzer = RoomAnalyzer()
+        analyzer = RoomAnalyzer(
+            client=state.openai_client,
+            status_tracker=state.status_tracker,
+            cache=redis_client
+        )
         start_time = time.time()
         
         result = await analyzer.analyze_images(image_paths, house_id)
@@ -61,26 +121,31 @@ async def process_images_background(house_id: str, image_paths: List[str]):
         processing_time = time.time() - start_time
         result["processing_time"] = processing_time
         
-        processing_status[house_id] = {
+        await set_processing_status(redis_client, house_id, {
             "status": "completed",
             "progress": 100,
             "result": result
-        }
+        })
         
         # Clean up uploaded files
         upload_dir = os.path.join(os.getenv('UPLOAD_DIR', 'uploads'), house_id)
         if os.path.exists(upload_dir):
-            shutil.rmtree(upload_dir)
+            await asyncio.to_thread(shutil.rmtree, upload_dir)
             
     except Exception as e:
-        processing_status[house_id] = {
-            "status": "failed",
-            "error": str(e),
-            "progress": 0
-        }
+        # The failure may be Redis itself, so recording it must not raise again
+        try:
+            await set_processing_status(redis_client, house_id, {
+                "status": "failed",
+                "error": str(e),
+                "progress": 0
+            })
+        except Exception as status_error:
+            print(f"Error recording failure for house {house_id}: {str(status_error)} (original error: {str(e)})")
 
 @router.post("/upload", response_model=UploadResponse)
 async def upload_images(
+    request: Request,
     background_tasks: BackgroundTasks,
     files: List[UploadFile] = File(...)
 ):
@@ -101,28 +166,26 @@ async def upload_images(
                 status_code=400, 
                 detail=f"File type not allowed: {file.filename}"
             )
-            
-        # Check file size
-        content = await file.read()
-        if len(content) > max_size:
+        
+        # Starlette records the parsed size, so oversized files are rejected before any copy;
+        # the streamed save still enforces the limit when the size is unknown
+        if file.size is not None and file.size > max_size:
             raise HTTPException(
                 status_code=400,
                 detail=f"File too large: {file.filename}"
             )
         
-        # Reset file pointer
-        await file.seek(0)
         valid_files.append(file)
     
     if not valid_files:
         raise HTTPException(status_code=400, detail="No valid files found")
     
-    # Generate house ID and save files
+    # Generate house ID and save files, enforcing the size limit while streaming
     house_id = str(uuid.uuid4())
-    image_paths = save_uploaded_files(valid_files, house_id)
+    image_paths = await save_uploaded_files(valid_files, house_id, max_size)
     
     # Start background processing
-    background_tasks.add_task(process_images_background, house_id, image_paths)
+    background_tasks.add_task(process_images_background, house_id, image_paths, request.app.state)
     
     return UploadResponse(
         message="Images uploaded successfully. Processing started.",
@@ -132,20 +195,15 @@ async def upload_images(
     )
 
 @router.get("/status/{house_id}")
-async def get_processing_status(house_id: str):
+async def get_processing_status(house_id: str, redis_client: Redis = Depends(get_redis)):
     """Get processing status for a house analysis"""
-    if house_id not in processing_status:
-        raise HTTPException(status_code=404, detail="House ID not found")
-    
-    return processing_status[house_id]
+    # Already JSON in Redis, so pass it through without decoding
+    return Response(await load_processing_status(redis_client, house_id), media_type='application/json')
 
 @router.get("/result/{house_id}", response_model=AnalysisResult)
-async def get_analysis_result(house_id: str):
+async def get_analysis_result(house_id: str, redis_client: Redis = Depends(get_redis)):
     """Get analysis result for a completed house analysis"""
-    if house_id not in processing_status:
-        raise HTTPException(status_code=404, detail="House ID not found")
-    
-    status_info = processing_status[house_id]
+    status_info = orjson.loads(await load_processing_status(redis_client, house_id))
     
     if status_info["status"] != "completed":
         raise HTTPException(
@@ -155,27 +213,31 @@ async def get_analysis_result(house_id: str):
     
     result = status_info["result"]
     
-    return AnalysisResult(
-        house_id=result["house_id"],
-        status=result["status"],
-        total_rooms=result["total_rooms"],
-        processing_time=result["processing_time"],
-        output_file=result["output_file"],
-        report=result["report"]
+    fields = {
+        "house_id": result["house_id"],
+        "status": result["status"],
+        "total_rooms": result["total_rooms"],
+        "processing_time": result["processing_time"],
+        "output_file": result["output_file"],
+        "report": result["report"]
+    }
+    if result["report"] is None:
+        return ORJSONResponse(fields)
+    
+    return StreamingResponse(
+        stream_json_object(fields, "report", stream_report(result["report"])),
+        media_type='application/json'
     )
 
 @router.get("/download/{house_id}")
-async def download_report(house_id: str):
+async def download_report(house_id: str, redis_client: Redis = Depends(get_redis)):
     """Download JSON report file"""
-    if house_id not in processing_status:
-        raise HTTPException(status_code=404, detail="House ID not found")
-    
-    status_info = processing_status[house_id]
+    status_info = orjson.loads(await load_processing_status(redis_client, house_id))
     if status_info["status"] != "completed":
         raise HTTPException(status_code=400, detail="Analysis not completed")
     
     output_file = status_info["result"]["output_file"]
-    if not os.path.exists(output_file):
+    if not output_file or not os.path.exists(output_file):
         raise HTTPException(status_code=404, detail="Report file not found")
     
     return FileResponse(
@@ -1,12 +1,17 @@
 from dotenv import load_dotenv
-import requests
+import httpx
+import asyncio
 import os
 from openai import OpenAI
 import base64
+from collections import Counter
 
 load_dotenv()
 
+landingai_url = "https://api.va.landing.ai/v1/tools/agentic-object-detection"
+
 room_object_list = ["couch", "light", "table", "chair", "window", "decoration", "curtain", "wardrobe", "fan", "plant"]
+room_label_set = set(room_object_list)
 
 client = OpenAI(api_key=os.getenv("openai_api_key"))
 
@@ -35,34 +40,33 @@ def generate_room_report(image_base64):
     )
     return response.choices[0].message.content
 
-def detect_object_counts(image_path):
+async def detect_object_counts(image_path):
+    with open(image_path, "rb") as image_file:
+        image_bytes = image_file.read()
+    headers = {
+    "Authorization": "Basic " + os.getenv("landingai_api_key")
+    }
+    # Ask for every label in one request and tally the detections locally
+    data = {
+    "prompts": room_object_list,
+    "model": "agentic"
+    }
+    files = {
+        "image": (os.path.basename(image_path), image_bytes)
+    }
+    async with httpx.AsyncClient(headers=headers, timeout=120) as http_client:
+        response = await http_client.post(landingai_url, files=files, data=data)
+    result=response.json()
+    counts = Counter(item["label"] for item in result["data"][0] if item["label"] in room_label_set)
     object_count_string=""
-    for object in room_object_list:
-
-        url = "https://api.va.landing.ai/v1/tools/agentic-object-detection"
-        files = {
-            "image": open(image_path, "rb")
-        }
-        data = {
-        "prompts": object,
-        "model": "agentic"
-        }
-        headers = {
-        "Authorization": "Basic " + os.getenv("landingai_api_key")
-        }
-        response = requests.post(url, files=files, data=data, headers=headers)
-        result=response.json()
-        counter = 0
-        for item in result["data"][0]:
-            if item["label"] == object:
-                counter += 1
-        object_count_string += f"Number of {object} detected: {counter}" + "\n"
+    for label in room_object_list:
+        object_count_string += f"Number of {label} detected: {counts[label]}" + "\n"
     return object_count_string
 
 if __name__ == "__main__":
     image_base64=image_to_base64(image_path)
     initial_assessment = generate_room_report(image_base64)
-    object_counts = detect_object_counts(image_path)
+    object_counts = asyncio.run(detect_object_counts(image_path))
     final_prompt = initial_assessment + object_counts + "\n" + "Given these two pieces of information about this room, estimate the building cost of this room assumed to be in India, excluding the location's land cost since that's extremely variable. Give a very brief answer of not more than two sentences, which clearly give the FINAL TOTAL COST."
     response = client.chat.completions.create(
         model="gpt-4o",